@@ -1,158 +1,325 @@
-import subprocess
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import sys
+import time
+import argparse
 import json
-import pickle
-import logging
-from aliyunsdkcore.client import AcsClient
-from aliyunsdkcore.acs_exception.exceptions import ServerException
-from aliyunsdkcore.auth.credentials import AccessKeyCredential
-from aliyunsdkalidns.request.v20150109.DescribeDomainRecordsRequest import DescribeDomainRecordsRequest
-from aliyunsdkalidns.request.v20150109.UpdateDomainRecordRequest import UpdateDomainRecordRequest
-import platform
+import re
+import ipaddress
+import socket
+import dns.exception
+import dns.resolver
+
+try:
+    import orjson  # 可选依赖，解析阿里云返回的json更快
+except ImportError:
+    orjson = None
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import traceback  # 用于捕获详细的错误信息
+from dns_common import (log_and_print, clear_dns_cache, get_user_input, save_config, load_config,
+                        save_state, load_state, clear_config)
 
-# 设置日志配置，指定编码为 UTF-8
-logging.basicConfig(filename="dns_update.log", level=logging.INFO, 
-                    format="%(asctime)s - %(levelname)s - %(message)s", 
-                    filemode="a", encoding="utf-8")  # 设置日志文件的编码
+CACHE_TTL = 300  # 上次确认解析与公网地址一致后，在此时间（秒）内跳过检测
+MIN_INTERVAL = 10  # 守护模式最小检测间隔（秒），不短于一次公网地址检测的最长耗时
+# 返回出口公网地址的服务，同时请求，取最先成功返回的结果
+IP_ECHO_URLS = [
+    "http://members.3322.org/dyndns/getip",
+    "https://api.ipify.org",
+    "https://ipv4.icanhazip.com",  # 只返回IPv4，双栈主机上也不会得到IPv6地址
+]
+SUPPORTED_TYPES = ("A",)  # 公网地址只检测IPv4，只有A记录可以和它比对
+DNS_TIMEOUT = 2  # 单次查询请求的等待时间（秒）
+DNS_LIFETIME = 4  # 每个DNS服务器的总等待时间（秒），含重试
+HTTP_TIMEOUT = (2, 3)  # (连接超时, 读取超时)
+# 只接受整行为IPv4地址的响应，避免把错误页面或劫持页面当作公网地址
+_IP_RE = re.compile(r'^\s*(\d{1,3}(?:\.\d{1,3}){3})\s*$', re.M)
 
-CONFIG_FILE = "dns_config.pkl"
+def resolve_domain(full_domain, dns_server, dns_type, fallback_dns_server=None):
+    # 直接向指定DNS服务器查询域名；仅当其超时且配置了备用服务器时，才改用备用服务器
+    servers = [dns_server] + ([fallback_dns_server] if fallback_dns_server else [])
+    try:
+        for server in servers:
+            try:
+                ipaddress.ip_address(server)
+            except ValueError:
+                # 与 nslookup 一样允许填写DNS服务器的主机名
+                server = socket.gethostbyname(server)
+            resolver = dns.resolver.Resolver(configure=False)
+            resolver.nameservers = [server]
+            resolver.timeout = DNS_TIMEOUT
+            resolver.lifetime = DNS_LIFETIME
+            try:
+                answers = resolver.resolve(full_domain, dns_type)
+            except dns.resolver.Timeout:
+                log_and_print(f"向 {server} 查询 {full_domain} 超时", level="error")
+                continue
+            resolved_ip = answers[0].address
+            log_and_print(f"解析的IP: {resolved_ip}")
+            return resolved_ip
+        # 全部超时，按未解析处理，继续走更新流程
+        return None
+    except (dns.exception.DNSException, ValueError, OSError) as e:
+        log_and_print(f"无法解析域名 {full_domain}：{e}", level="error")
+        return None
 
-def log_and_print(message, level="info"):
-    print(message)
-    if level == "info":
-        logging.info(message)
-    elif level == "error":
-        logging.error(message)
+def create_session():
+    # 多个服务本就同时请求，只对临时性的服务端错误重试一次，连接失败不重试，
+    # 使单个卡住的服务最多占用约两次 HTTP_TIMEOUT
+    retry = Retry(total=1, connect=0, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_ip(session, url):
+    response = session.get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    m = _IP_RE.search(response.text)
+    if not m:
+        return None
+    # 正则只检查格式，各段是否在 0-255 之间由 ipaddress 校验
+    try:
+        return str(ipaddress.IPv4Address(m.group(1)))
+    except ValueError:
+        return None
 
-def clear_dns_cache():
-    os_name = platform.system()
+def get_public_ip(session):
+    # 检测出口公网地址，多个服务同时请求，避免单个服务过慢拖住整个流程
+    executor = ThreadPoolExecutor(max_workers=len(IP_ECHO_URLS))
     try:
-        if os_name == "Windows":
-            subprocess.run(["ipconfig", "/flushdns"], check=True)
-        elif os_name == "Darwin":  # macOS
-            subprocess.run(["sudo", "killall", "-HUP", "mDNSResponder"], check=True)
-        elif os_name == "Linux":
-            subprocess.run(["sudo", "systemd-resolve", "--flush-caches"], check=True)
-        log_and_print("DNS缓存已清理。")
-    except subprocess.CalledProcessError:
-        log_and_print("清理DNS缓存时出错。", level="error")
-
-def get_user_input(prompt, default=None):
-    user_input = input(f"{prompt} (默认: {default}): ") or default
-    return user_input
-
-def save_config(config):
-    with open(CONFIG_FILE, 'wb') as f:  # 保持为二进制模式
-        pickle.dump(config, f)
-
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, 'rb') as f:  # 保持为二进制模式读取
-            return pickle.load(f)
+        futures = {executor.submit(fetch_ip, session, url): url for url in IP_ECHO_URLS}
+        for future in as_completed(futures):
+            try:
+                public_ip = future.result()
+            except requests.RequestException as e:
+                log_and_print(f"从 {futures[future]} 获取公网地址失败：{e}", level="error")
+                continue
+            if public_ip:
+                log_and_print(f"检测到的公网地址: {public_ip}")
+                return public_ip
+            log_and_print(f"{futures[future]} 返回的内容不是有效的IP地址", level="error")
+    finally:
+        # 拿到结果后立即返回、取消未开始的请求；已发出的请求仍在后台运行，
+        # 进程退出前会等待其结束，最长时间由 HTTP_TIMEOUT 和上面的重试次数限定
+        executor.shutdown(wait=False, cancel_futures=True)
+    log_and_print("无法获取公网地址", level="error")
     return None
 
-def clear_config():
-    if os.path.exists(CONFIG_FILE):
-        os.remove(CONFIG_FILE)
-        log_and_print("配置已清除。")
-    else:
-        log_and_print("没有找到配置文件。")
+_client = None
+
+def get_client():
+    # AcsClient 在整个进程内复用，守护模式下可保持与阿里云的连接
+    global _client
+    if _client is None:
+        # 阿里云SDK依赖较多，仅在确实需要更新记录时才导入
+        from aliyunsdkcore.client import AcsClient
+        from aliyunsdkcore.auth.credentials import AccessKeyCredential
+        credentials = AccessKeyCredential(os.environ['ALIBABA_CLOUD_ACCESS_KEY_ID'], os.environ['ALIBABA_CLOUD_ACCESS_KEY_SECRET'])
+        _client = AcsClient(region_id='cn-hangzhou', credential=credentials)
+    return _client
+
+def find_record_id(client, domain, domain_name, dns_type):
+    from aliyunsdkalidns.request.v20150109.DescribeSubDomainRecordsRequest import DescribeSubDomainRecordsRequest
+
+    # 按完整子域名精确查询，RRKeyWord 是模糊匹配，可能命中 xabc、abc2 等其他记录
+    request = DescribeSubDomainRecordsRequest()
+    request.set_accept_format('json')
+    request.set_SubDomain(f"{domain}.{domain_name}")
+    request.set_Type(dns_type)
+
+    response = client.do_action_with_exception(request)
+    if response:
+        records = orjson.loads(response) if orjson else json.loads(response)
+        for r in records['DomainRecords']['Record']:
+            if r['RR'] == domain and r['Type'] == dns_type:
+                return r['RecordId']
+    return None
+
+def update_record(client, record_id, domain, dns_type, public_ip):
+    from aliyunsdkalidns.request.v20150109.UpdateDomainRecordRequest import UpdateDomainRecordRequest
+
+    update_request = UpdateDomainRecordRequest()
+    update_request.set_accept_format('json')
+    update_request.set_RecordId(record_id)
+    update_request.set_RR(domain)
+    update_request.set_Type(dns_type)
+    update_request.set_Value(public_ip)
+    return client.do_action_with_exception(update_request)
+
+def update_record_ip(client, record, public_ip):
+    # 更新单条记录，成功返回 True；出错只记录日志，不影响其他记录
+    from aliyunsdkcore.acs_exception.exceptions import ClientException, ServerException
+
+    domain = record["rr"]
+    domain_name = record["domain_name"]
+    dns_type = record["type"]
 
-def main():
     try:
-        # 清理DNS缓存
-        clear_dns_cache()
+        # RecordID 不会变化，查询一次后缓存在配置中
+        record_id = record.get("record_id")
+        using_cached_record_id = bool(record_id)
+        if not record_id:
+            record_id = find_record_id(client, domain, domain_name, dns_type)
+            if not record_id:
+                log_and_print("未找到RecordID，无法更新DNS记录", level="error")
+                return False
+            record["record_id"] = record_id
+
+        try:
+            update_response = update_record(client, record_id, domain, dns_type, public_ip)
+        except ServerException as e:
+            if not (using_cached_record_id and e.error_code == "InvalidRecordId.NotFound"):
+                raise
+            # 缓存的RecordID已失效（记录被删除重建），重新查询一次
+            log_and_print("缓存的RecordID已失效，重新查询。")
+            record.pop("record_id", None)
+            record_id = find_record_id(client, domain, domain_name, dns_type)
+            if not record_id:
+                log_and_print("未找到RecordID，无法更新DNS记录", level="error")
+                return False
+            record["record_id"] = record_id
+            update_response = update_record(client, record_id, domain, dns_type, public_ip)
+        log_and_print(f"DNS记录更新成功：{str(update_response, encoding='utf-8')}")
+        return True
+    except ServerException as e:
+        if e.error_code == "DomainRecordDuplicate":
+            # 记录已经是该值（解析服务器仍返回缓存的旧结果），视为已是最新
+            log_and_print("DNS记录已是当前公网地址，无需重复更新。")
+            return True
+        log_and_print(f"DNS记录更新时发生错误：{e.error_code} - {e.message}", level="error")
+        return False
+    except ClientException as e:
+        log_and_print(f"调用阿里云接口时发生错误：{e.error_code} - {e.message}", level="error")
+        return False
+
+def update_dns(session, config, use_cache=True):
+    dns_server = config["dns_server"]
+    records = config["records"]
+    full_domains = [f"{record['rr']}.{record['domain_name']}" for record in records]
+
+    # 最近已确认全部记录与公网地址一致，跳过本轮检测；守护模式按 --interval 检测，不使用该缓存
+    state = load_state() if use_cache else None
+    if state and state.get("domains") == full_domains and time.time() - state["last_update_ts"] < CACHE_TTL:
+        log_and_print(f"{CACHE_TTL}秒内已确认解析为 {state['last_public_ip']}，跳过本次检测。")
+        return
+
+    # 公网地址只查询一次，各记录的解析结果与之并行查询
+    with ThreadPoolExecutor(max_workers=min(16, len(records)) + 1) as executor:
+        public_ip_future = executor.submit(get_public_ip, session)
+        resolve_futures = [executor.submit(resolve_domain, full_domain, dns_server, record["type"],
+                                           config.get("fallback_dns_server"))
+                           for full_domain, record in zip(full_domains, records)]
+        public_ip = public_ip_future.result()
+        resolved_ips = []
+        for full_domain, future in zip(full_domains, resolve_futures):
+            try:
+                resolved_ips.append(future.result())
+            except Exception:
+                # 单条记录解析出错按未解析处理，不影响其他记录
+                log_and_print(f"解析 {full_domain} 时发生异常：", level="error")
+                log_and_print(traceback.format_exc(), level="error")
+                resolved_ips.append(None)
+
+    if not public_ip:
+        return
+
+    all_updated = True
+    for full_domain, record, resolved_ip in zip(full_domains, records, resolved_ips):
+        # 比对IP
+        if resolved_ip and resolved_ip == public_ip:
+            log_and_print(f"{full_domain} 的解析和检测到的公网地址一致，无需更新DNS记录。")
+            continue
+
+        log_and_print(f"解析的IP和检测到的公网地址不一致，准备更新 {full_domain} 的DNS记录。")
+        # 所有记录共用同一个 AcsClient
+        if not update_record_ip(get_client(), record, public_ip):
+            all_updated = False
+
+    if all_updated:
+        save_state(full_domains, public_ip)
+
+def main(daemon=False, interval=300, flush_cache=False):
+    try:
+        # 清理DNS缓存（仅在指定 --flush-cache 时）
+        if flush_cache:
+            clear_dns_cache()
 
         # 检查是否存在已保存的配置
-        saved_config = load_config()
+        config = load_config()
         using_saved_config = False
-        if saved_config:
-            dns_server, domain, dns_type, domain_name = saved_config
+        if config:
             using_saved_config = True
             log_and_print("使用保存的配置：")
+        elif not sys.stdin.isatty():
+            # 非交互环境（cron、systemd 等）无法输入配置，也不能拿示例默认值去调用阿里云
+            log_and_print("没有找到已保存的配置，请先在终端中运行一次并保存配置。", level="error")
+            return
         else:
-            dns_server = get_user_input("请输入自定义DNS服务器", "8.8.8.8")
-            domain = get_user_input("请输入子域名", "abc")
-            dns_type = get_user_input("请输入DNS记录类型", "A")
-            domain_name = get_user_input("请输入域名（domainname）", "mylabcdd.top")
+            config = {
+                "dns_server": get_user_input("请输入自定义DNS服务器", "8.8.8.8"),
+                "records": [{
+                    "rr": get_user_input("请输入子域名", "abc"),
+                    "type": get_user_input("请输入DNS记录类型", "A"),
+                    "domain_name": get_user_input("请输入域名（domainname）", "mylabcdd.top"),
+                }],
+            }
 
-        log_and_print(f"DNS服务器: {dns_server}, 子域名: {domain}, 记录类型: {dns_type}, 域名: {domain_name}")
+        log_and_print(f"DNS服务器: {config['dns_server']}")
+        for record in config["records"]:
+            log_and_print(f"子域名: {record['rr']}, 记录类型: {record['type']}, 域名: {record['domain_name']}")
+            if record["type"] not in SUPPORTED_TYPES:
+                log_and_print(f"不支持的记录类型 {record['type']}，只支持 {'/'.join(SUPPORTED_TYPES)}。", level="error")
+                return
 
-        # 使用 nslookup 解析域名
-        full_domain = f"{domain}.{domain_name}"
-        resolved_ip = None
-        try:
-            result = subprocess.run(["nslookup", full_domain, dns_server], capture_output=True, text=True, check=True)
-            output = result.stdout
-            for line in output.splitlines():
-                if "Address" in line and not line.startswith("Non-authoritative"):
-                    ip_candidate = line.split()[-1]
-                    if ip_candidate != dns_server:
-                        resolved_ip = ip_candidate
-                        break
-            log_and_print(f"解析的IP: {resolved_ip}")
-        except subprocess.CalledProcessError:
-            log_and_print("无法解析域名", level="error")
+        # 复用同一个 Session，守护模式下每轮检测无需重新建立连接
+        session = create_session()
+        ask_save = not using_saved_config
+        while True:
+            record_ids = [record.get("record_id") for record in config["records"]]
+            try:
+                update_dns(session, config, use_cache=not daemon)
+            except Exception:
+                if not daemon:
+                    raise
+                # 守护模式下单轮失败不退出，等待下一轮重试
+                log_and_print("本轮检测发生异常：", level="error")
+                log_and_print(traceback.format_exc(), level="error")
 
-        # 检测出口公网地址
-        response = requests.get("http://members.3322.org/dyndns/getip")
-        public_ip = response.text.strip()
-        log_and_print(f"检测到的公网地址: {public_ip}")
+            # 新查询到的RecordID写回已保存的配置
+            if using_saved_config and [record.get("record_id") for record in config["records"]] != record_ids:
+                save_config(config)
 
-        # 比对IP
-        if resolved_ip and resolved_ip == public_ip:
-            log_and_print("解析的IP和检测到的公网地址一致，无需更新DNS记录。")
-        else:
-            log_and_print(f"解析的IP和检测到的公网地址不一致，准备更新 {full_domain} 的DNS记录。")
-
-            # 获取RecordID
-            credentials = AccessKeyCredential(os.environ['ALIBABA_CLOUD_ACCESS_KEY_ID'], os.environ['ALIBABA_CLOUD_ACCESS_KEY_SECRET'])
-            client = AcsClient(region_id='cn-hangzhou', credential=credentials)
-
-            request = DescribeDomainRecordsRequest()
-            request.set_accept_format('json')
-            request.set_DomainName(domain_name)
-            request.set_RRKeyWord(domain)  # 使用子域名部分作为RR
-
-            response = client.do_action_with_exception(request)
-            record_id = None
-
-            if response:
-                records = json.loads(response)
-                if records['DomainRecords']['Record']:
-                    record_id = records['DomainRecords']['Record'][0]['RecordId']  # 根据实际返回格式调整
-
-            if record_id:
-                update_request = UpdateDomainRecordRequest()
-                update_request.set_accept_format('json')
-                update_request.set_RecordId(record_id)
-                update_request.set_RR(domain)
-                update_request.set_Type(dns_type)
-                update_request.set_Value(public_ip)
-
-                try:
-                    update_response = client.do_action_with_exception(update_request)
-                    log_and_print("DNS记录更新成功", str(update_response, encoding='utf-8'))
-                except ServerException as e:
-                    if e.error_code == "DomainRecordDuplicate":
-                        log_and_print("错误：DNS记录已存在，无法重复更新。", level="error")
-                    else:
-                        log_and_print(f"DNS记录更新时发生错误：{e.error_code} - {e.message}", level="error")
-            else:
-                log_and_print("未找到RecordID，无法更新DNS记录", level="error")
+            # 如果没有使用保存的配置，询问是否保存当前配置（非交互环境不询问）
+            if ask_save and sys.stdin.isatty():
+                ask_save = False
+                if input("是否保存当前配置？(y/n)").lower() == 'y':
+                    save_config(config)
+                    using_saved_config = True
+                    log_and_print("配置已保存。")
 
-        # 如果没有使用保存的配置，询问是否保存当前配置
-        if not using_saved_config and input("是否保存当前配置？(y/n)").lower() == 'y':
-            save_config((dns_server, domain, dns_type, domain_name))
-            log_and_print("配置已保存。")
+            if not daemon:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        log_and_print("程序已退出。")
     except Exception as e:
         log_and_print("程序运行时发生异常：", level="error")
         log_and_print(traceback.format_exc(), level="error")
 
 if __name__ == "__main__":
-    if len(os.sys.argv) > 1 and os.sys.argv[1] == 'clear':
+    parser = argparse.ArgumentParser(description="通过修改阿里云DNS记录实现DDNS")
+    parser.add_argument("command", nargs="?", choices=["clear"], help="clear: 清除已保存的配置")
+    parser.add_argument("--daemon", action="store_true", help="常驻运行，按固定间隔循环检测")
+    parser.add_argument("--interval", type=int, default=300, help="守护模式下的检测间隔（秒），默认300")
+    parser.add_argument("--flush-cache", action="store_true", help="运行前清理本机DNS缓存")
+    args = parser.parse_args()
+    if args.interval < MIN_INTERVAL:
+        parser.error(f"--interval 不能小于 {MIN_INTERVAL} 秒")
+
+    if args.command == 'clear':
         clear_config()
     else:
-        main()
+        main(daemon=args.daemon, interval=args.interval, flush_cache=args.flush_cache)
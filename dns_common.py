@@ -0,0 +1,109 @@
+import subprocess
+import os
+import time
+import json
+import pickle
+import logging
+import platform
+import shutil
+
+# 设置日志配置，指定编码为 UTF-8
+logging.basicConfig(filename="dns_update.log", level=logging.INFO, 
+                    format="%(asctime)s - %(levelname)s - %(message)s", 
+                    filemode="a", encoding="utf-8")  # 设置日志文件的编码
+
+CONFIG_FILE = "dns_config.json"
+LEGACY_CONFIG_FILE = "dns_config.pkl"  # 旧版本使用 pickle 保存的配置，仅用于一次性迁移
+STATE_FILE = "dns_state.json"
+
+def log_and_print(message, level="info"):
+    print(message)
+    if level == "info":
+        logging.info(message)
+    elif level == "error":
+        logging.error(message)
+
+def clear_dns_cache():
+    # 后台执行，不等待命令结束；本脚本直接向指定DNS服务器查询，本就不经过本地缓存
+    # sudo -n 不会询问密码，避免与配置输入争用终端；无免密权限时清理直接失败
+    os_name = platform.system()
+    try:
+        if os_name == "Windows":
+            subprocess.Popen(["ipconfig", "/flushdns"])
+        elif os_name == "Darwin":  # macOS
+            subprocess.Popen(["sudo", "-n", "killall", "-HUP", "mDNSResponder"])
+        elif os_name == "Linux":
+            flush_linux_dns_cache()
+        log_and_print("已发起DNS缓存清理。")
+    except OSError:
+        log_and_print("清理DNS缓存时出错。", level="error")
+
+def flush_linux_dns_cache():
+    # 优先通过 D-Bus 调用 systemd-resolved，无需启动子进程和 sudo
+    # pydbus 为可选依赖，且会加载 GLib，只在确实需要清理缓存时导入
+    try:
+        from pydbus import SystemBus
+    except ImportError:
+        SystemBus = None
+    if SystemBus is not None:
+        try:
+            SystemBus().get(".resolve1").FlushCaches()
+            return
+        except Exception as e:
+            log_and_print(f"通过D-Bus清理DNS缓存失败，改用命令行：{e}", level="error")
+    # systemd-resolve 已弃用，优先使用 resolvectl
+    if shutil.which("resolvectl"):
+        subprocess.Popen(["sudo", "-n", "resolvectl", "flush-caches"])
+    else:
+        subprocess.Popen(["sudo", "-n", "systemd-resolve", "--flush-caches"])
+
+def get_user_input(prompt, default=None):
+    user_input = input(f"{prompt} (默认: {default}): ") or default
+    return user_input
+
+def save_config(config):
+    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+
+def load_config():
+    # 旧版本的 pickle 配置只读取一次，随即改写为 json
+    if not os.path.exists(CONFIG_FILE) and os.path.exists(LEGACY_CONFIG_FILE):
+        with open(LEGACY_CONFIG_FILE, 'rb') as f:
+            dns_server, domain, dns_type, domain_name = pickle.load(f)
+        save_config({"dns_server": dns_server, "records": [{"rr": domain, "type": dns_type, "domain_name": domain_name}]})
+        os.remove(LEGACY_CONFIG_FILE)
+        log_and_print("已将旧版配置迁移为json格式。")
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if not isinstance(config, dict) or "dns_server" not in config or "records" not in config:
+        log_and_print(f"配置文件 {CONFIG_FILE} 格式不正确，已忽略。", level="error")
+        return None
+    return config
+
+def save_state(full_domains, public_ip):
+    with open(STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump({"domains": full_domains, "last_public_ip": public_ip, "last_update_ts": time.time()}, f)
+
+def load_state():
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def clear_config():
+    if os.path.exists(STATE_FILE):
+        os.remove(STATE_FILE)
+    # 未迁移的旧版配置也一并删除，否则下次运行会被重新迁移回来
+    found = False
+    for path in (CONFIG_FILE, LEGACY_CONFIG_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+            found = True
+    if found:
+        log_and_print("配置已清除。")
+    else:
+        log_and_print("没有找到配置文件。")